@@ -5,13 +5,23 @@
 Sistema Lista BraSoft – Preenchimento Diário (v1.5.2)
 """
 import json, os, re, sys, unicodedata
+from functools import lru_cache
 from pathlib import Path
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox, simpledialog
 
+import numpy as np
 import pandas as pd
-from openpyxl.styles import PatternFill
-from openpyxl.utils import get_column_letter
+
+try:
+    import orjson
+    def _dumps(o) -> str:
+        return orjson.dumps(o, option=orjson.OPT_INDENT_2).decode("utf-8")
+    _loads = orjson.loads
+except ImportError:
+    def _dumps(o) -> str:
+        return json.dumps(o, ensure_ascii=False, indent=2)
+    _loads = json.loads
 
 APP_TITLE = "Sistema Lista BraSoft – Preenchimento Diário"
 MAP_FILENAME = "sku_map.json"
@@ -21,15 +31,26 @@ def app_dir() -> Path:
         return Path(sys.executable).parent
     return Path(__file__).parent
 
+_ACCENT_TABLE = str.maketrans("áàâãäéèêëíìîïóòôõöúùûüçñÁÀÂÃÄÉÈÊËÍÌÎÏÓÒÔÕÖÚÙÛÜÇÑ",
+                              "aaaaaeeeeiiiiooooouuuucnAAAAAEEEEIIIIOOOOOUUUUCN")
+
 def strip_accents(s: str) -> str:
+    if s.isascii():
+        return s
+    s = s.translate(_ACCENT_TABLE)
+    if s.isascii():
+        return s
     try:
         return ''.join(c for c in unicodedata.normalize('NFKD', s) if not unicodedata.combining(c))
     except Exception:
         return s
 
+@lru_cache(maxsize=65536)
 def normalize_token(s: str) -> str:
     if not isinstance(s, str):
         return ""
+    if s.isascii():
+        return re.sub(r'[^a-z0-9]', '', s.lower())
     s = strip_accents(s).lower()
     s = re.sub(r'\s+', '', s)
     s = re.sub(r'[^a-z0-9]', '', s)
@@ -46,7 +67,7 @@ def load_map_file(path: Path) -> dict:
     if not path.exists():
         return default_map_dict()
     try:
-        data = json.loads(path.read_text(encoding="utf-8"))
+        data = _loads(path.read_text(encoding="utf-8"))
         data.setdefault("priorities", default_map_dict()["priorities"])
         data.setdefault("categories", {})
         data.setdefault("special_rules", default_map_dict()["special_rules"])
@@ -61,53 +82,67 @@ def load_map_file(path: Path) -> dict:
 def save_map_file(path: Path, data: dict):
     try:
         path.parent.mkdir(parents=True, exist_ok=True)
+        # aliases em memória já vêm normalizados (load_map_file / diálogos)
         for cat, meta in data.get("categories", {}).items():
-            meta["aliases"] = sorted(set([normalize_token(a) for a in meta.get("aliases", [])]))
             meta.setdefault("output_format", "numeric")
-        path.write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8")
+        path.write_text(_dumps(data), encoding="utf-8")
     except Exception as e:
         messagebox.showerror("Erro", f"Falha ao salvar mapa em {path}:\n{e}")
 
+def ordered_categories(cfg: dict) -> list:
+    # prioridades primeiro, depois o resto em ordem alfabética
+    categories = cfg["categories"]
+    prios = [c for c in cfg.get("priorities", []) if c in categories]
+    seen = set(prios)
+    return prios + [c for c in sorted(categories, key=str.lower) if c not in seen]
+
+def build_alias_index(cfg: dict) -> dict:
+    # alias normalizado -> categoria; em alias repetido vale a primeira categoria do mapa
+    index = {}
+    for cat, meta in cfg.get("categories", {}).items():
+        for a in meta.get("aliases", []):
+            index.setdefault(a, cat)
+    return index
+
 # regex
-QTD_PATTERNS = [
-    re.compile(r'Quantity:\s*(\d+)', re.IGNORECASE),
-    re.compile(r'"Quantity"\s*[:=]\s*"?(\d+)"?', re.IGNORECASE),
-    re.compile(r'\bqty\s*[:=]\s*(\d+)', re.IGNORECASE),
-    re.compile(r'\bquantity\s*[:=]\s*(\d+)', re.IGNORECASE),
-    re.compile(r'^\s*\[(\d+)\]\s', re.IGNORECASE),
-]
+# uma alternativa por formato de quantidade, testadas nesta ordem de prioridade
+QTD_RE = re.compile(
+    r'\A(?:(?=.*?Quantity:\s*(\d+))'
+    r'|(?=.*?"Quantity"\s*[:=]\s*"?(\d+)"?)'
+    r'|(?=.*?\bqty\s*[:=]\s*(\d+))'
+    r'|(?=.*?\bquantity\s*[:=]\s*(\d+))'
+    r'|(?=\s*\[(\d+)\]\s))',
+    re.IGNORECASE | re.DOTALL)
 SKU_IN_PRODUCT_INFO = re.compile(r'SKU Reference No\.\s*:\s*([A-Za-z0-9_\-\. ]+)', re.IGNORECASE)
-VAR_IN_PRODUCT_INFO = re.compile(r'Variation Name\s*:\s*([^;\\n]+)', re.IGNORECASE)
-BLOCK_RE = re.compile(r'\[\d+\][^\[]+', re.IGNORECASE | re.DOTALL)
-
-def extract_quantity_from_text(text: str, fallback=None):
-    if isinstance(text, str):
-        for pat in QTD_PATTERNS:
-            m = pat.search(text)
-            if m:
-                try:
-                    return int(m.group(1))
-                except Exception:
-                    continue
-    return 1 if fallback is None else fallback
-
-def extract_sku_and_var_from_text(text: str):
-    sku_raw = ""
-    variation = ""
-    if not isinstance(text, str) or text.strip() == "":
-        return sku_raw, variation
-    m = SKU_IN_PRODUCT_INFO.search(text)
-    if m:
-        sku_raw = m.group(1).strip()
-    m2 = VAR_IN_PRODUCT_INFO.search(text)
-    if m2:
-        variation = m2.group(1).strip()
-    return sku_raw, variation
+VAR_IN_PRODUCT_INFO = re.compile(r'Variation Name\s*:\s*([^;\n]+)', re.IGNORECASE)
+BLOCK_RE = re.compile(r'(\[\d+\][^\[]+)', re.IGNORECASE | re.DOTALL)
+KIT_RE = re.compile(r'\b(\d+)\b')
+
+def normalize_series(s: pd.Series) -> pd.Series:
+    # versão vetorizada de normalize_token
+    return (s.fillna("").astype(str).str.normalize('NFKD')
+             .str.encode('ascii', 'ignore').str.decode('ascii')
+             .str.lower().str.replace(r'[^a-z0-9]', '', regex=True))
+
+# um registro por bloco '[n] ...' de cada linha: sku_raw, variation, qty
+def parse_blocks(text: pd.Series) -> pd.DataFrame:
+    blocks = text.str.extractall(BLOCK_RE)[0]
+    # linhas sem '[n]' viram um único bloco com o texto inteiro
+    loose = text[~text.index.isin(blocks.index.get_level_values(0))]
+    loose.index = pd.MultiIndex.from_arrays([loose.index, [0] * len(loose)], names=blocks.index.names)
+    blocks = pd.concat([blocks, loose]).sort_index()
+
+    qty = pd.to_numeric(blocks.str.extract(QTD_RE).bfill(axis=1).iloc[:, 0], errors='coerce')
+    return pd.DataFrame({
+        "sku_raw": blocks.str.extract(SKU_IN_PRODUCT_INFO, expand=False).str.strip().fillna(""),
+        "variation": blocks.str.extract(VAR_IN_PRODUCT_INFO, expand=False).str.strip().fillna(""),
+        "qty": qty.fillna(1).astype(int),
+    }, index=blocks.index)
 
 def quant_kit_from_variation(variation: str) -> int:
     if not isinstance(variation, str) or not variation.strip():
         return 1
-    m = re.search(r'\b(\d+)\b', variation)
+    m = KIT_RE.search(variation)
     if m:
         try:
             return int(m.group(1))
@@ -115,43 +150,29 @@ def quant_kit_from_variation(variation: str) -> int:
             return 1
     return 1
 
-def compute_category_from_variation(initial_category, variation, enc_capa_cat, enc_base_cat):
-    v = variation or ""
-    v_norm = normalize_token(v)
-    has_encosto = "encosto" in v_norm
-    has_capa_extra = "capaextra" in v_norm
-    has_com_capa = "comcapa" in v_norm or "+capa" in v_norm
-    if has_encosto and has_capa_extra:
-        return enc_capa_cat
-    if has_encosto and has_com_capa and initial_category != enc_capa_cat:
-        return enc_base_cat
-    return initial_category
-
-def compute_outputs_single_item(sku_raw, variation, qty_from_block, cfg: dict):
-    kit_qty = quant_kit_from_variation(variation)
-    kits_purchased = qty_from_block if qty_from_block else 1
-    unidades = kit_qty * kits_purchased
-    sku_norm = normalize_token(sku_raw)
-    category = ""
-    for cat, meta in cfg["categories"].items():
-        if sku_norm in meta.get("aliases", []):
-            category = cat
-            break
-    enc_capa_cat = cfg.get("special_rules", {}).get("enc_capa_category", "ENC_CAPA")
-    enc_base_cat = cfg.get("special_rules", {}).get("enc_base_category", "ENC")
-    category = compute_category_from_variation(category, variation, enc_capa_cat, enc_base_cat)
-    outputs = {}
-    if category:
-        if category == enc_capa_cat and "capaextra" in normalize_token(variation or ""):
-            outputs[category] = {"type": "enc_capa", "value": kits_purchased}
-        else:
-            outputs[category] = {"type": "numeric", "value": unidades}
-    diag = {
-        "sku_raw": sku_raw or "", "sku_norm": sku_norm, "category": category,
-        "kit_qty": kit_qty, "kits_purchased": kits_purchased, "unidades": unidades,
-        "variation_seen": variation or ""
-    }
-    return outputs, diag
+# bits de variation_flags
+VAR_ENCOSTO, VAR_CAPA_EXTRA, VAR_COM_CAPA = 1, 2, 4
+
+def variation_flags(var_norm: pd.Series) -> np.ndarray:
+    return (var_norm.str.contains("encosto", regex=False).to_numpy() * VAR_ENCOSTO
+            | var_norm.str.contains("capaextra", regex=False).to_numpy() * VAR_CAPA_EXTRA
+            | var_norm.str.contains("comcapa", regex=False).to_numpy() * VAR_COM_CAPA)
+
+def compute_category_from_variation(initial_category: pd.Series, flags: np.ndarray, enc_capa_cat, enc_base_cat) -> np.ndarray:
+    has_encosto = (flags & VAR_ENCOSTO) > 0
+    has_capa_extra = (flags & VAR_CAPA_EXTRA) > 0
+    has_com_capa = (flags & VAR_COM_CAPA) > 0
+    initial = initial_category.to_numpy(dtype=object)
+    return np.where(has_encosto & has_capa_extra, enc_capa_cat,
+                    np.where(has_encosto & has_com_capa & (initial != enc_capa_cat), enc_base_cat, initial))
+
+def read_orders(path: Path) -> pd.DataFrame:
+    # só as colunas usadas; calamine (Rust) quando instalado, senão o leitor padrão
+    usecols = lambda c: c in ("order_sn", "product_info")
+    try:
+        return pd.read_excel(path, engine='calamine', usecols=usecols)
+    except (ImportError, ValueError):
+        return pd.read_excel(path, usecols=usecols)
 
 class App(tk.Tk):
     def __init__(self):
@@ -252,11 +273,7 @@ class App(tk.Tk):
 
     def _refresh_list(self):
         self.list_categories.delete(0, tk.END)
-        cats = sorted(self.cfg["categories"].keys(), key=str.lower)
-        prios = [c for c in self.cfg.get("priorities", []) if c in cats]
-        others = [c for c in cats if c not in prios]
-        cats = prios + others
-        for c in cats:
+        for c in ordered_categories(self.cfg):
             self.list_categories.insert(tk.END, c)
         self.txt_aliases.delete("1.0", tk.END)
 
@@ -331,7 +348,7 @@ class App(tk.Tk):
         if not self.orders_path or not self.orders_path.exists():
             messagebox.showerror("Erro", "Selecione a planilha da Shopee (orders.xlsx)."); return
         try:
-            df = pd.read_excel(self.orders_path)
+            df = read_orders(self.orders_path)
         except Exception as e:
             messagebox.showerror("Erro", f"Falha ao abrir Excel:\n{e}"); return
 
@@ -340,107 +357,106 @@ class App(tk.Tk):
         if product_info_col is None:
             messagebox.showerror("Erro", "Não encontrei a coluna 'product_info'."); return
 
-        categories = list(self.cfg["categories"].keys())
-        prios = [c for c in self.cfg.get("priorities", []) if c in categories]
-        remaining = [c for c in sorted(categories, key=str.lower) if c not in prios]
-        out_cols = prios + remaining
-
-        detail_rows, diag_rows = [], []
-
-        for _, row in df.iterrows():
-            order_sn = row.get(order_col, '')
-            product_info = row.get(product_info_col, '')
-
-            blocks = BLOCK_RE.findall(product_info) if isinstance(product_info, str) else []
-            if not blocks:
-                blocks = [product_info] if isinstance(product_info, str) else []
-
-            accum_numeric = {}
-            accum_enc_capa = 0
-            per_block_variations, per_block_sku = [], []
-
-            for blk in blocks:
-                sku_raw, variation = extract_sku_and_var_from_text(blk)
-                qty_blk = extract_quantity_from_text(blk, fallback=1)
-                outputs, diag = compute_outputs_single_item(sku_raw, variation, qty_blk, self.cfg)
-                per_block_variations.append(diag["variation_seen"])
-                per_block_sku.append(diag["sku_raw"])
-                diag_rows.append({"order_sn": order_sn, **diag})
-                for col, meta in outputs.items():
-                    if meta["type"] == "numeric":
-                        accum_numeric[col] = accum_numeric.get(col, 0) + meta["value"]
-                    elif meta["type"] == "enc_capa":
-                        accum_enc_capa += meta["value"]
-
-            base = {'order_sn': order_sn,
-                    'SKU Reference No.': "; ".join([s for s in per_block_sku if s]),
-                    'Variation Name': "; ".join([v for v in per_block_variations if v]),
-                    'product_info': product_info if isinstance(product_info, str) else str(product_info)}
-            for c in out_cols: base[c] = ""
-            for c, val in accum_numeric.items(): base[c] = val
-            if accum_enc_capa > 0: base["ENC_CAPA"] = f"{accum_enc_capa} + C"
-            detail_rows.append(base)
-
-        df_det = pd.DataFrame(detail_rows, columns=['order_sn', 'SKU Reference No.', 'Variation Name', 'product_info'] + out_cols)
-
-        def sum_or_blank(series):
-            try:
-                numeric = pd.to_numeric(series, errors='coerce')
-                s = numeric.sum(min_count=1)
-                return "" if pd.isna(s) else int(s)
-            except Exception:
-                return ""
-
-        agg_map = {}
-        for c in out_cols:
-            if c == "ENC_CAPA":
-                agg_map[c] = lambda s: sum([int(str(x).split()[0]) for x in s if str(x).strip()])
-            else:
-                agg_map[c] = sum_or_blank
-        resumo = df_det.groupby('order_sn', as_index=False).agg(agg_map)
-
+        out_cols = ordered_categories(self.cfg)
+
+        alias_index = build_alias_index(self.cfg)
+        enc_capa_cat = self.cfg.get("special_rules", {}).get("enc_capa_category", "ENC_CAPA")
+        enc_base_cat = self.cfg.get("special_rules", {}).get("enc_base_category", "ENC")
+
+        df = df.reset_index(drop=True)
+        df[product_info_col] = df[product_info_col].fillna("").astype(str)
+        order_sn = df[order_col] if order_col else pd.Series("", index=df.index)
+        items = parse_blocks(df[product_info_col])
+        rows = items.index.get_level_values(0)
+
+        kit_qty = items["variation"].map(quant_kit_from_variation)
+        kits_purchased = items["qty"].where(items["qty"] != 0, 1)
+        unidades = kit_qty * kits_purchased
+        sku_norm = normalize_series(items["sku_raw"])
+        flags = variation_flags(normalize_series(items["variation"]))
+        category = compute_category_from_variation(sku_norm.map(alias_index).fillna(""), flags, enc_capa_cat, enc_base_cat)
+        diag = pd.DataFrame({
+            "order_sn": order_sn.reindex(rows).to_numpy(), "sku_raw": items["sku_raw"], "sku_norm": sku_norm,
+            "category": category, "kit_qty": kit_qty, "kits_purchased": kits_purchased, "unidades": unidades,
+            "variation_seen": items["variation"]
+        }, index=items.index)
+
+        is_enc_capa = (diag["category"] == enc_capa_cat) & ((flags & VAR_CAPA_EXTRA) > 0)
+        # soma por (linha, coluna) em matrizes: unidades e quantos blocos caíram ali
+        row_idx = rows.to_numpy()
+        col_idx = pd.Index(out_cols).get_indexer(diag["category"])
+        sel = (col_idx >= 0) & ~is_enc_capa.to_numpy()
+        numeric = np.zeros((len(df), len(out_cols)), dtype=np.int64)
+        hits = np.zeros((len(df), len(out_cols)), dtype=np.int64)
+        np.add.at(numeric, (row_idx[sel], col_idx[sel]), unidades.to_numpy()[sel])
+        np.add.at(hits, (row_idx[sel], col_idx[sel]), 1)
+        enc = is_enc_capa.to_numpy()
+        accum_enc_capa = pd.Series(np.bincount(row_idx[enc], weights=kits_purchased.to_numpy()[enc],
+                                               minlength=len(df)).astype(np.int64), index=df.index)
+
+        def join_blocks(col):
+            s = diag.loc[diag[col] != "", col]
+            return s.groupby(s.index.get_level_values(0)).agg("; ".join).reindex(df.index, fill_value="")
+
+        df_det = pd.DataFrame({
+            'order_sn': order_sn,
+            'SKU Reference No.': join_blocks("sku_raw"),
+            'Variation Name': join_blocks("variation_seen"),
+            'product_info': df[product_info_col],
+        })
+        for j, c in enumerate(out_cols):
+            df_det[c] = pd.Series(numeric[:, j], index=df.index, dtype=object).where(hits[:, j] > 0, "")
+        # ENC_CAPA fica numérico (kits com capa extra, senão unidades); "N + C" só na saída
+        enc_capa_n = pd.Series(0, index=df.index)
+        has_enc_capa = pd.Series(False, index=df.index)
+        if enc_capa_cat in out_cols:
+            j = out_cols.index(enc_capa_cat)
+            enc_capa_n = accum_enc_capa.where(accum_enc_capa > 0, numeric[:, j])
+            has_enc_capa = (accum_enc_capa > 0) | (hits[:, j] > 0)
+            df_det[enc_capa_cat] = df_det[enc_capa_cat].where(accum_enc_capa == 0, accum_enc_capa.astype(str) + " + C")
+        diag = diag.reset_index(drop=True)
+
+        # Resumo direto das matrizes: uma soma agrupada por order_sn (vazio onde não houve bloco)
+        keys = order_sn.rename('order_sn')
+        sums = pd.DataFrame(numeric, index=df.index, columns=out_cols).groupby(keys).sum()
+        counts = pd.DataFrame(hits, index=df.index, columns=out_cols).groupby(keys).sum()
+        resumo = sums.astype(object).where(counts > 0, "")
         total_row = {'order_sn': 'TOTAL'}
-        for c in out_cols:
-            if c == "ENC_CAPA":
-                nums = []
-                for x in df_det[c].tolist():
-                    try:
-                        n = int(str(x).split()[0]); nums.append(n)
-                    except Exception: pass
-                total_row[c] = (f"{sum(nums)} + C") if nums else ""
-            else:
-                total_row[c] = sum_or_blank(df_det[c])
-        resumo = pd.concat([resumo, pd.DataFrame([total_row])], ignore_index=True)
+        for j, c in enumerate(out_cols):
+            total_row[c] = int(numeric[:, j].sum()) if hits[:, j].any() else ""
+        if enc_capa_cat in out_cols:
+            resumo[enc_capa_cat] = enc_capa_n.groupby(keys).sum()
+            total_row[enc_capa_cat] = f"{int(enc_capa_n.sum())} + C" if has_enc_capa.any() else ""
+        resumo = resumo.reset_index()
+        resumo.loc[len(resumo)] = total_row
 
         out_path = self.orders_path.with_name("preenchido.xlsx")
         try:
-            with pd.ExcelWriter(out_path, engine='openpyxl') as writer:
+            # linha sem nenhum valor nas colunas de produto fica amarela
+            vals = df_det[out_cols]
+            empty_rows = np.flatnonzero((vals.isna() | vals.isin(["", 0])).all(axis=1).to_numpy())
+
+            with pd.ExcelWriter(out_path, engine='xlsxwriter') as writer:
                 df_det.to_excel(writer, sheet_name='ItensDetalhados', index=False)
                 resumo.to_excel(writer, sheet_name='Resumo', index=False)
-                pd.DataFrame(diag_rows).to_excel(writer, sheet_name='Diagnostico', index=False)
-
-                wb = writer.book; ws_det = wb['ItensDetalhados']
-                yellow = PatternFill(start_color="FFF3B0", end_color="FFF3B0", fill_type="solid")
-                header_row = 1; data_start = header_row + 1
-                for r in range(data_start, data_start + len(df_det)):
-                    start_idx = 5
-                    if all((ws_det.cell(row=r, column=start_idx + i).value in (None, "", 0)) for i in range(len(out_cols))):
-                        for c in range(1, ws_det.max_column + 1):
-                            ws_det.cell(row=r, column=c).fill = yellow
-
-                def autosize(ws):
-                    widths = {}
-                    for row in ws.iter_rows():
-                        for cell in row:
-                            val = cell.value
-                            length = len(str(val)) if val is not None else 0
-                            col = cell.column
-                            widths[col] = max(widths.get(col, 0), length)
-                    for i, w in widths.items():
-                        ws.column_dimensions[get_column_letter(i)].width = min(max(w + 2, 10), 60)
-
-                autosize(ws_det); autosize(wb['Resumo']); autosize(wb['Diagnostico'])
-                writer._save()
+                if self.chk_diag.get():
+                    diag.to_excel(writer, sheet_name='Diagnostico', index=False)
+
+                ws_det = writer.sheets['ItensDetalhados']
+                yellow = writer.book.add_format({"bg_color": "#FFF3B0"})
+                for r in empty_rows:
+                    ws_det.set_row(int(r) + 1, None, yellow)
+
+                def autosize(ws, frame):
+                    for i, c in enumerate(frame.columns):
+                        col = frame[c]
+                        length = col.astype(object).where(col.notna(), "").astype(str).str.len().max() if len(col) else 0
+                        w = max(len(str(c)), int(length))
+                        ws.set_column(i, i, min(max(w + 2, 10), 60))
+
+                autosize(ws_det, df_det); autosize(writer.sheets['Resumo'], resumo)
+                if self.chk_diag.get():
+                    autosize(writer.sheets['Diagnostico'], diag)
 
             self.status.config(text=f"Gerado: {out_path.name}")
             messagebox.showinfo("Concluído", f"Arquivo gerado:\n{out_path}")